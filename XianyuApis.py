@@ -1,158 +1,248 @@
+import asyncio
 import time
 import os
 import re
 import sys
+import threading
 
+import orjson
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from utils.xianyu_utils import generate_sign
 
+_ENV_PATH = os.path.join(os.getcwd(), '.env')
+_COOKIES_RE = re.compile(r'COOKIES_STR=.*')
+_APPKEY = "444e9908a51d1cb236a27862abc769c9"
+
+_DEFAULT_HEADERS = {
+    'accept': 'application/json',
+    'accept-language': 'zh-CN,zh;q=0.9',
+    'cache-control': 'no-cache',
+    'origin': 'https://www.goofish.com',
+    'pragma': 'no-cache',
+    'priority': 'u=1, i',
+    'referer': 'https://www.goofish.com/',
+    'sec-ch-ua': '"Not(A:Brand";v="99", "Google Chrome";v="133", "Chromium";v="133"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'sec-fetch-dest': 'empty',
+    'sec-fetch-mode': 'cors',
+    'sec-fetch-site': 'same-site',
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
+}
+
+_shared_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def _get_shared_adapter():
+    """获取进程内共享的HTTPAdapter，所有XianyuApis实例复用同一个urllib3连接池"""
+    global _shared_adapter
+    if _shared_adapter is None:
+        with _adapter_lock:
+            if _shared_adapter is None:
+                # 连接池与传输层重试：网络错误和5xx由urllib3在socket层重试，无需重新签名
+                retry = Retry(
+                    total=3,
+                    backoff_factor=0.5,
+                    status_forcelist=[500, 502, 503, 504],
+                    allowed_methods=frozenset(['GET', 'POST']),
+                    raise_on_status=False,
+                )
+                _shared_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retry)
+    return _shared_adapter
+
+
+_request_sem = None
+
+
+def _get_request_semaphore():
+    """获取进程内共享的信号量，限制所有XianyuApis实例同时进行的上游请求数，避免触发限流"""
+    global _request_sem
+    # 信号量只在事件循环线程中使用，首次使用时创建即可，无需加锁
+    if _request_sem is None:
+        _request_sem = asyncio.Semaphore(int(os.getenv("XIANYU_MAX_INFLIGHT", "20")))
+    return _request_sem
+
 
 class XianyuApis:
     def __init__(self):
         self.url = 'https://h5api.m.goofish.com/h5/mtop.taobao.idlemessage.pc.login.token/1.0/'
+        # cookies按账号隔离，每个实例独立的Session；连接池则在实例间共享
         self.session = requests.Session()
-        self.session.headers.update({
-            'accept': 'application/json',
-            'accept-language': 'zh-CN,zh;q=0.9',
-            'cache-control': 'no-cache',
-            'origin': 'https://www.goofish.com',
-            'pragma': 'no-cache',
-            'priority': 'u=1, i',
-            'referer': 'https://www.goofish.com/',
-            'sec-ch-ua': '"Not(A:Brand";v="99", "Google Chrome";v="133", "Chromium";v="133"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'sec-fetch-dest': 'empty',
-            'sec-fetch-mode': 'cors',
-            'sec-fetch-site': 'same-site',
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
-        })
+        self.session.headers.update(_DEFAULT_HEADERS)
+        self.session.mount('https://', _get_shared_adapter())
+        # 缓存从_m_h5_tk中解析出的token，cookies变更时失效
+        self._cached_tk = None
+        # .env写入去抖：cookies变更只做标记，由定时器合并后统一落盘
+        self._env_flush_interval = 5
+        self._env_dirty = False
+        self._env_flush_timer = None
+        self._env_lock = threading.Lock()
+        # 启动时缓存.env的各行内容，刷新时只替换COOKIES_STR所在行
+        self._env_lines = None
+        self._cookies_idx = None
+        self._load_env_lines()
+        
+    def _cookies_lock(self):
+        """
+        获取cookie jar自身的锁
         
+        请求在线程池中并发执行，requests写入响应cookies时持有该锁；
+        遍历jar时也需持有，否则可能出现dictionary changed size during iteration
+        """
+        return self.session.cookies._cookies_lock
+
+    def _get_cookie(self, name, default=''):
+        """线程安全地读取单个cookie"""
+        with self._cookies_lock():
+            return self.session.cookies.get(name, default)
+
     def clear_duplicate_cookies(self):
         """清理重复的cookies"""
-        # 创建一个新的CookieJar
-        new_jar = requests.cookies.RequestsCookieJar()
-        
-        # 记录已经添加过的cookie名称
-        added_cookies = set()
-        
-        # 按照cookies列表的逆序遍历（最新的通常在后面）
-        cookie_list = list(self.session.cookies)
-        cookie_list.reverse()
-        
-        for cookie in cookie_list:
-            # 如果这个cookie名称还没有添加过，就添加到新jar中
-            if cookie.name not in added_cookies:
-                new_jar.set_cookie(cookie)
-                added_cookies.add(cookie.name)
-                
-        # 替换session的cookies
-        self.session.cookies = new_jar
+        jar = self.session.cookies
+        with self._cookies_lock():
+            # 同名cookie只保留最新的一个（最新的通常在后面，字典后写覆盖先写）
+            latest = {cookie.name: cookie for cookie in jar}
+            # 原地重建jar，避免替换对象后并发请求写入的cookies丢失
+            jar.clear()
+            for cookie in latest.values():
+                jar.set_cookie(cookie)
+        self._cached_tk = None
         
         # 更新完cookies后，更新.env文件
         self.update_env_cookies()
+
+    def _get_tk(self):
+        """获取签名用的token，优先使用缓存"""
+        if not self._cached_tk:
+            self._cached_tk = self._get_cookie('_m_h5_tk').partition('_')[0]
+        return self._cached_tk
+
+    async def _post(self, url, params=None, data=None):
+        """在线程池中执行阻塞的POST请求，避免阻塞事件循环"""
+        async with _get_request_semaphore():
+            response = await asyncio.to_thread(self.session.post, url, params=params, data=data)
+        # 服务端在成功响应中也可能轮换_m_h5_tk，此时缓存的token已失效
+        if '_m_h5_tk' in response.cookies:
+            self._cached_tk = None
+        return response
         
     def update_env_cookies(self):
+        """标记cookies已变更，在flush间隔内合并多次更新后再写入.env文件"""
+        with self._env_lock:
+            self._env_dirty = True
+            if self._env_flush_timer is None:
+                self._env_flush_timer = threading.Timer(self._env_flush_interval, self.flush_env_cookies)
+                self._env_flush_timer.start()
+
+    def flush_env_cookies(self):
         """更新.env文件中的COOKIES_STR"""
+        with self._env_lock:
+            self._env_flush_timer = None
+            if not self._env_dirty:
+                return
+            self._env_dirty = False
+
+        if self._env_lines is None:
+            logger.warning(".env文件不存在，无法更新COOKIES_STR")
+            return
+        if self._cookies_idx is None:
+            logger.warning(".env文件中未找到COOKIES_STR配置项")
+            return
+
         try:
             # 获取当前cookies的字符串形式
-            cookie_str = '; '.join([f"{cookie.name}={cookie.value}" for cookie in self.session.cookies])
+            with self._cookies_lock():
+                cookie_str = '; '.join([f"{cookie.name}={cookie.value}" for cookie in self.session.cookies])
             
-            # 读取.env文件
-            env_path = os.path.join(os.getcwd(), '.env')
-            if not os.path.exists(env_path):
-                logger.warning(".env文件不存在，无法更新COOKIES_STR")
-                return
-                
-            with open(env_path, 'r', encoding='utf-8') as f:
-                env_content = f.read()
-                
-            # 使用正则表达式替换COOKIES_STR的值
-            if 'COOKIES_STR=' in env_content:
-                new_env_content = re.sub(
-                    r'COOKIES_STR=.*', 
-                    f'COOKIES_STR={cookie_str}',
-                    env_content
-                )
+            # 只在内存中替换COOKIES_STR所在行，无需重新读取.env文件
+            line = self._env_lines[self._cookies_idx]
+            self._env_lines[self._cookies_idx] = _COOKIES_RE.sub(f'COOKIES_STR={cookie_str}', line)
+            
+            # 写回.env文件
+            with open(_ENV_PATH, 'w', encoding='utf-8') as f:
+                f.writelines(self._env_lines)
                 
-                # 写回.env文件
-                with open(env_path, 'w', encoding='utf-8') as f:
-                    f.write(new_env_content)
-                    
-                logger.debug("已更新.env文件中的COOKIES_STR")
-            else:
-                logger.warning(".env文件中未找到COOKIES_STR配置项")
+            logger.debug("已更新.env文件中的COOKIES_STR")
         except Exception as e:
             logger.warning(f"更新.env文件失败: {str(e)}")
+            # 恢复变更标记，下次cookies更新时重新写入
+            with self._env_lock:
+                self._env_dirty = True
+
+    def _load_env_lines(self):
+        """读取.env文件并定位COOKIES_STR所在行"""
+        if not os.path.exists(_ENV_PATH):
+            return
+        try:
+            with open(_ENV_PATH, 'r', encoding='utf-8') as f:
+                self._env_lines = f.readlines()
+        except Exception as e:
+            logger.warning(f"读取.env文件失败: {str(e)}")
+            return
+        self._cookies_idx = next(
+            (i for i, line in enumerate(self._env_lines) if _COOKIES_RE.search(line)),
+            None
+        )
         
-    def hasLogin(self, retry_count=0):
+    async def hasLogin(self, max_retries=2):
         """调用hasLogin.do接口进行登录状态检查"""
-        if retry_count >= 2:
-            logger.error("Login检查失败，重试次数过多")
-            return False
-            
-        try:
-            url = 'https://passport.goofish.com/newlogin/hasLogin.do'
-            params = {
-                'appName': 'xianyu',
-                'fromSite': '77'
-            }
-            data = {
-                'hid': self.session.cookies.get('unb', ''),
-                'ltl': 'true',
-                'appName': 'xianyu',
-                'appEntrance': 'web',
-                '_csrf_token': self.session.cookies.get('XSRF-TOKEN', ''),
-                'umidToken': '',
-                'hsiz': self.session.cookies.get('cookie2', ''),
-                'bizParams': 'taobaoBizLoginFrom=web',
-                'mainPage': 'false',
-                'isMobile': 'false',
-                'lang': 'zh_CN',
-                'returnUrl': '',
-                'fromSite': '77',
-                'isIframe': 'true',
-                'documentReferer': 'https://www.goofish.com/',
-                'defaultView': 'hasLogin',
-                'umidTag': 'SERVER',
-                'deviceId': self.session.cookies.get('cna', '')
-            }
-            
-            response = self.session.post(url, params=params, data=data)
-            res_json = response.json()
-            
-            if res_json.get('content', {}).get('success'):
+        url = 'https://passport.goofish.com/newlogin/hasLogin.do'
+        params = {
+            'appName': 'xianyu',
+            'fromSite': '77'
+        }
+        data = {
+            'hid': self._get_cookie('unb'),
+            'ltl': 'true',
+            'appName': 'xianyu',
+            'appEntrance': 'web',
+            '_csrf_token': self._get_cookie('XSRF-TOKEN'),
+            'umidToken': '',
+            'hsiz': self._get_cookie('cookie2'),
+            'bizParams': 'taobaoBizLoginFrom=web',
+            'mainPage': 'false',
+            'isMobile': 'false',
+            'lang': 'zh_CN',
+            'returnUrl': '',
+            'fromSite': '77',
+            'isIframe': 'true',
+            'documentReferer': 'https://www.goofish.com/',
+            'defaultView': 'hasLogin',
+            'umidTag': 'SERVER',
+            'deviceId': self._get_cookie('cna')
+        }
+
+        for _ in range(max_retries):
+            try:
+                response = await self._post(url, params=params, data=data)
+                res_json = orjson.loads(response.content)
+                success = res_json.get('content', {}).get('success')
+            except Exception as e:
+                logger.error(f"Login请求异常: {str(e)}")
+                await asyncio.sleep(0.5)
+                continue
+
+            if success:
                 logger.debug("Login成功")
                 # 清理和更新cookies
                 self.clear_duplicate_cookies()
                 return True
-            else:
-                logger.warning(f"Login失败: {res_json}")
-                time.sleep(0.5)
-                return self.hasLogin(retry_count + 1)
-                
-        except Exception as e:
-            logger.error(f"Login请求异常: {str(e)}")
-            time.sleep(0.5)
-            return self.hasLogin(retry_count + 1)
 
-    def get_token(self, device_id, retry_count=0):
-        if retry_count >= 2:  # 最多重试3次
-            logger.warning("获取token失败，尝试重新登陆")
-            # 尝试通过hasLogin重新登录
-            if self.hasLogin():
-                logger.info("重新登录成功，重新尝试获取token")
-                return self.get_token(device_id, 0)  # 重置重试次数
-            else:
-                logger.error("重新登录失败，Cookie已失效")
-                logger.error("🔴 程序即将退出，请更新.env文件中的COOKIES_STR后重新启动")
-                sys.exit(1)  # 直接退出程序
-            
+            logger.warning(f"Login失败: {res_json}")
+            await asyncio.sleep(0.5)
+
+        logger.error("Login检查失败，重试次数过多")
+        return False
+
+    async def get_token(self, device_id, max_retries=2):
         params = {
             'jsv': '2.7.2',
             'appKey': '34839810',
-            't': str(int(time.time()) * 1000),
+            't': '',
             'sign': '',
             'v': '1.0',
             'type': 'originaljson',
@@ -163,54 +253,56 @@ class XianyuApis:
             'sessionOption': 'AutoLoginOnly',
             'spm_cnt': 'a21ybx.im.0.0',
         }
-        data_val = '{"appKey":"444e9908a51d1cb236a27862abc769c9","deviceId":"' + device_id + '"}'
+        data_val = orjson.dumps({"appKey": _APPKEY, "deviceId": device_id}).decode()
         data = {
             'data': data_val,
         }
-        
-        # 简单获取token，信任cookies已清理干净
-        token = self.session.cookies.get('_m_h5_tk', '').split('_')[0]
-        
-        sign = generate_sign(params['t'], token, data_val)
-        params['sign'] = sign
-        
-        try:
-            response = self.session.post('https://h5api.m.goofish.com/h5/mtop.taobao.idlemessage.pc.login.token/1.0/', params=params, data=data)
-            res_json = response.json()
-            
-            if isinstance(res_json, dict):
+
+        while True:
+            for _ in range(max_retries):
+                # 每次尝试只刷新时间戳和签名，token信任cookies已清理干净
+                params['t'] = str(time.time_ns() // 1_000_000)
+                params['sign'] = generate_sign(params['t'], self._get_tk(), data_val)
+
+                try:
+                    response = await self._post('https://h5api.m.goofish.com/h5/mtop.taobao.idlemessage.pc.login.token/1.0/', params=params, data=data)
+                    res_json = orjson.loads(response.content)
+                except Exception as e:
+                    logger.error(f"Token API请求异常: {str(e)}")
+                    return {"error": f"Token API请求异常: {str(e)}"}
+
+                if not isinstance(res_json, dict):
+                    logger.error(f"Token API返回格式异常: {res_json}")
+                    continue
+
                 ret_value = res_json.get('ret', [])
                 # 检查ret是否包含成功信息
-                if not any('SUCCESS::调用成功' in ret for ret in ret_value):
-                    logger.warning(f"Token API调用失败，错误信息: {ret_value}")
-                    # 处理响应中的Set-Cookie
-                    if 'Set-Cookie' in response.headers:
-                        logger.debug("检测到Set-Cookie，更新cookie")  # 降级为DEBUG并简化
-                        self.clear_duplicate_cookies()
-                    time.sleep(0.5)
-                    return self.get_token(device_id, retry_count + 1)
-                else:
+                if any('SUCCESS::调用成功' in ret for ret in ret_value):
                     logger.info("Token获取成功")
                     return res_json
-            else:
-                logger.error(f"Token API返回格式异常: {res_json}")
-                return self.get_token(device_id, retry_count + 1)
-                
-        except Exception as e:
-            logger.error(f"Token API请求异常: {str(e)}")
-            time.sleep(0.5)
-            return self.get_token(device_id, retry_count + 1)
 
-    def get_item_info(self, item_id, retry_count=0):
+                logger.warning(f"Token API调用失败，错误信息: {ret_value}")
+                # 处理响应中的Set-Cookie
+                if 'Set-Cookie' in response.headers:
+                    logger.debug("检测到Set-Cookie，更新cookie")  # 降级为DEBUG并简化
+                    self.clear_duplicate_cookies()
+                await asyncio.sleep(0.5)
+
+            logger.warning("获取token失败，尝试重新登陆")
+            # 尝试通过hasLogin重新登录
+            if await self.hasLogin():
+                logger.info("重新登录成功，重新尝试获取token")
+                continue  # 重置重试次数
+            logger.error("重新登录失败，Cookie已失效")
+            logger.error("🔴 程序即将退出，请更新.env文件中的COOKIES_STR后重新启动")
+            sys.exit(1)  # 直接退出程序
+
+    async def get_item_info(self, item_id, max_retries=3):
         """获取商品信息，自动处理token失效的情况"""
-        if retry_count >= 3:  # 最多重试3次
-            logger.error("获取商品信息失败，重试次数过多")
-            return {"error": "获取商品信息失败，重试次数过多"}
-            
         params = {
             'jsv': '2.7.2',
             'appKey': '34839810',
-            't': str(int(time.time()) * 1000),
+            't': '',
             'sign': '',
             'v': '1.0',
             'type': 'originaljson',
@@ -222,45 +314,44 @@ class XianyuApis:
             'spm_cnt': 'a21ybx.im.0.0',
         }
         
-        data_val = '{"itemId":"' + item_id + '"}'
+        data_val = orjson.dumps({"itemId": item_id}).decode()
         data = {
             'data': data_val,
         }
-        
-        # 简单获取token，信任cookies已清理干净
-        token = self.session.cookies.get('_m_h5_tk', '').split('_')[0]
-        
-        sign = generate_sign(params['t'], token, data_val)
-        params['sign'] = sign
-        
-        try:
-            response = self.session.post(
-                'https://h5api.m.goofish.com/h5/mtop.taobao.idle.pc.detail/1.0/', 
-                params=params, 
-                data=data
-            )
-            
-            res_json = response.json()
+
+        for _ in range(max_retries):
+            # 每次尝试只刷新时间戳和签名，token信任cookies已清理干净
+            params['t'] = str(time.time_ns() // 1_000_000)
+            params['sign'] = generate_sign(params['t'], self._get_tk(), data_val)
+
+            try:
+                response = await self._post(
+                    'https://h5api.m.goofish.com/h5/mtop.taobao.idle.pc.detail/1.0/', 
+                    params=params, 
+                    data=data
+                )
+                res_json = orjson.loads(response.content)
+            except Exception as e:
+                logger.error(f"商品信息API请求异常: {str(e)}")
+                return {"error": f"商品信息API请求异常: {str(e)}"}
+
             # 检查返回状态
-            if isinstance(res_json, dict):
-                ret_value = res_json.get('ret', [])
-                # 检查ret是否包含成功信息
-                if not any('SUCCESS::调用成功' in ret for ret in ret_value):
-                    logger.warning(f"商品信息API调用失败，错误信息: {ret_value}")
-                    # 处理响应中的Set-Cookie
-                    if 'Set-Cookie' in response.headers:
-                        logger.debug("检测到Set-Cookie，更新cookie")
-                        self.clear_duplicate_cookies()
-                    time.sleep(0.5)
-                    return self.get_item_info(item_id, retry_count + 1)
-                else:
-                    logger.debug(f"商品信息获取成功: {item_id}")
-                    return res_json
-            else:
+            if not isinstance(res_json, dict):
                 logger.error(f"商品信息API返回格式异常: {res_json}")
-                return self.get_item_info(item_id, retry_count + 1)
-                
-        except Exception as e:
-            logger.error(f"商品信息API请求异常: {str(e)}")
-            time.sleep(0.5)
-            return self.get_item_info(item_id, retry_count + 1)
+                continue
+
+            ret_value = res_json.get('ret', [])
+            # 检查ret是否包含成功信息
+            if any('SUCCESS::调用成功' in ret for ret in ret_value):
+                logger.debug("商品信息获取成功: {}", item_id)
+                return res_json
+
+            logger.warning(f"商品信息API调用失败，错误信息: {ret_value}")
+            # 处理响应中的Set-Cookie
+            if 'Set-Cookie' in response.headers:
+                logger.debug("检测到Set-Cookie，更新cookie")
+                self.clear_duplicate_cookies()
+            await asyncio.sleep(0.5)
+
+        logger.error("获取商品信息失败，重试次数过多")
+        return {"error": "获取商品信息失败，重试次数过多"}
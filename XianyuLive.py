@@ -8,7 +8,7 @@ from loguru import logger
 from dotenv import load_dotenv
 import sys
 
-from utils.xianyu_utils import generate_mid, generate_uuid, trans_cookies, generate_device_id, decrypt
+from utils.xianyu_utils import generate_mid, generate_uuid, trans_cookies, generate_device_id, decrypt_bytes
 from XianyuApis import XianyuApis
 from context_manager import ChatContextManager
 
@@ -66,6 +66,16 @@ class XianyuLive:
         
         # AI响应监听任务
         self.ai_response_task = None
+        
+        # 消息写入缓冲，突发消息攒批后一次性写入数据库
+        self.message_batch_size = 50
+        self.message_batch_delay = 0.05
+        self.pending_messages = []
+        self.message_flush_task = None
+        self.message_flush_lock = asyncio.Lock()
+        
+        # 商品信息预加载任务，保存引用防止任务被回收
+        self.prefetch_tasks = set()
 
     async def refresh_token(self):
         """刷新token"""
@@ -73,7 +83,7 @@ class XianyuLive:
             logger.info("开始刷新token...")
             
             # 获取新token（如果Cookie失效，get_token会直接退出程序）
-            token_result = self.xianyu.get_token(self.device_id)
+            token_result = await self.xianyu.get_token(self.device_id)
             if 'data' in token_result and 'accessToken' in token_result['data']:
                 new_token = token_result['data']['accessToken']
                 self.current_token = new_token
@@ -418,7 +428,7 @@ class XianyuLive:
                         
                         # 更新对话上下文
                         if item_id:
-                            self.context_manager.add_message_by_chat(chat_id, self.myid, item_id, "assistant", reply_content)
+                            await self.queue_message(chat_id, self.myid, item_id, "assistant", reply_content)
                     else:
                         logger.warning("WebSocket连接不可用，无法发送AI回复")
                         
@@ -483,7 +493,7 @@ class XianyuLive:
                     return
                 except Exception as e:
                     # logger.info(f'加密数据: {data}')
-                    decrypted_data = decrypt(data)
+                    decrypted_data = decrypt_bytes(data)
                     message = json.loads(decrypted_data)
             except Exception as e:
                 logger.error(f"消息解密失败: {e}")
@@ -516,7 +526,7 @@ class XianyuLive:
                 return
             elif not self.is_chat_message(message):
                 logger.debug("其他非聊天消息")
-                logger.debug(f"原始消息: {message}")
+                logger.debug("原始消息: {}", message)
                 return
 
             # 处理聊天消息
@@ -538,7 +548,7 @@ class XianyuLive:
             if not item_id:
                 logger.warning("无法获取商品ID")
                 return
-
+            
             # 检查是否为卖家（自己）发送的控制命令
             if send_user_id == self.myid:
                 logger.debug("检测到卖家消息，检查是否为控制命令")
@@ -550,34 +560,38 @@ class XianyuLive:
                         logger.info(f"🔴 已接管会话 {chat_id} (商品: {item_id})")
                     else:
                         logger.info(f"🟢 已恢复会话 {chat_id} 的自动回复 (商品: {item_id})")
+                    self.prefetch_item(item_id)
                     return
                 
                 # 记录卖家人工回复
-                self.context_manager.add_message_by_chat(chat_id, self.myid, item_id, "assistant", send_message)
+                await self.queue_message(chat_id, self.myid, item_id, "assistant", send_message)
                 logger.info(f"卖家人工回复 (会话: {chat_id}, 商品: {item_id}): {send_message}")
+                self.prefetch_item(item_id)
                 return
             
             logger.info(f"用户: {send_user_name} (ID: {send_user_id}), 商品: {item_id}, 会话: {chat_id}, 消息: {send_message}")
             # 添加用户消息到上下文
-            self.context_manager.add_message_by_chat(chat_id, send_user_id, item_id, "user", send_message)
+            await self.queue_message(chat_id, send_user_id, item_id, "user", send_message)
             
             # 如果当前会话处于人工接管模式，不进行自动回复
             if self.is_manual_mode(chat_id):
                 logger.info(f"🔴 会话 {chat_id} 处于人工接管模式，跳过自动回复")
+                self.prefetch_item(item_id)
                 return
             if self.is_system_message(message):
                 logger.debug("系统消息，跳过处理")
+                self.prefetch_item(item_id)
                 return
                 
             # 从数据库中获取商品信息，如果不存在则从API获取并保存
-            item_info = self.context_manager.get_item_info(item_id)
+            item_info = await self.context_manager.aget_item_info(item_id)
             if not item_info:
                 logger.info(f"从API获取商品信息: {item_id}")
-                api_result = self.xianyu.get_item_info(item_id)
+                api_result = await self.xianyu.get_item_info(item_id)
                 if 'data' in api_result and 'itemDO' in api_result['data']:
                     item_info = api_result['data']['itemDO']
                     # 保存商品信息到数据库
-                    self.context_manager.save_item_info(item_id, item_info)
+                    await self.context_manager.asave_item_info(item_id, item_info)
                 else:
                     logger.warning(f"获取商品信息失败: {api_result}")
                     return
@@ -586,8 +600,9 @@ class XianyuLive:
                 
             item_description = f"{item_info['desc']};当前商品售卖价格为:{str(item_info['soldPrice'])}"
             
-            # 获取完整的对话上下文
-            context = self.context_manager.get_context_by_chat(chat_id)
+            # 获取完整的对话上下文，先写入缓冲中的消息以保证上下文完整
+            await self.flush_messages()
+            context = await self.context_manager.aget_context_by_chat(chat_id)
             
             # 如果Redis可用，将消息推送到队列
             if self.redis:
@@ -620,7 +635,48 @@ class XianyuLive:
             
         except Exception as e:
             logger.error(f"处理消息时发生错误: {str(e)}")
-            logger.debug(f"原始消息: {message_data}")
+            logger.debug("原始消息: {}", message_data)
+
+    def prefetch_item(self, item_id):
+        """
+        后台将商品信息预加载到缓存，商品详情接口可直接命中缓存
+        
+        自动回复流程本身会读取商品信息并写入缓存，只在提前返回的分支中调用
+        """
+        prefetch_task = asyncio.create_task(self.context_manager.ensure_item_cached(item_id))
+        self.prefetch_tasks.add(prefetch_task)
+        prefetch_task.add_done_callback(self.prefetch_tasks.discard)
+
+    async def queue_message(self, chat_id, user_id, item_id, role, content):
+        """
+        将消息加入写入缓冲，攒够一批或等待片刻后统一写入数据库
+        
+        Args:
+            chat_id: 会话ID
+            user_id: 用户ID
+            item_id: 商品ID
+            role: 消息角色 (user/assistant)
+            content: 消息内容
+        """
+        self.pending_messages.append((chat_id, user_id, item_id, role, content))
+        if len(self.pending_messages) >= self.message_batch_size:
+            await self.flush_messages()
+        elif self.message_flush_task is None or self.message_flush_task.done():
+            self.message_flush_task = asyncio.create_task(self._delayed_flush_messages())
+
+    async def _delayed_flush_messages(self):
+        """等待攒批延迟后写入缓冲中的消息"""
+        await asyncio.sleep(self.message_batch_delay)
+        await self.flush_messages()
+
+    async def flush_messages(self):
+        """将缓冲中的消息批量写入数据库"""
+        # 加锁保证各批次按顺序落库
+        async with self.message_flush_lock:
+            if not self.pending_messages:
+                return
+            rows, self.pending_messages = self.pending_messages, []
+            await self.context_manager.aadd_messages_by_chat(rows)
 
     async def send_heartbeat(self, ws):
         """
@@ -772,7 +828,7 @@ class XianyuLive:
                             logger.error("消息解析失败")
                         except Exception as e:
                             logger.error(f"处理消息时发生错误: {str(e)}")
-                            logger.debug(f"原始消息: {message}")
+                            logger.debug("原始消息: {}", message)
 
             except websockets.exceptions.ConnectionClosed:
                 logger.warning("WebSocket连接已关闭")
@@ -803,6 +859,9 @@ class XianyuLive:
                     except asyncio.CancelledError:
                         pass
                 
+                # 写入缓冲中尚未落库的消息
+                await self.flush_messages()
+                
                 # 如果是主动重启，立即重连；否则等待5秒
                 if self.connection_restart_flag:
                     logger.info("主动重启连接，立即重连...")
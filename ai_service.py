@@ -1,5 +1,5 @@
 import asyncio
-import json
+import orjson
 import os
 import sys
 import time
@@ -32,6 +32,11 @@ class AIService:
         self.running = False
         # 支持处理多个卖家的消息
         self.seller_ids = set()
+        # 每次从队列批量取出的最大消息数
+        self.batch_size = int(os.getenv("AI_BATCH_SIZE", "32"))
+        # 回复批量推送的数量与时间阈值
+        self.reply_flush_size = int(os.getenv("AI_REPLY_FLUSH_SIZE", "100"))
+        self.reply_flush_interval = float(os.getenv("AI_REPLY_FLUSH_INTERVAL", "0.1"))
         
     async def connect_redis(self):
         """连接到Redis"""
@@ -75,7 +80,7 @@ class AIService:
         """
         try:
             # 解析消息
-            message = json.loads(message_data)
+            message = orjson.loads(message_data)
             
             # 提取必要信息
             chat_id = message.get("chat_id")
@@ -92,9 +97,7 @@ class AIService:
             
             # 这里可以调用实际的AI模型生成回复
             # 简单示例：生成一个回复
-            reply_content = f"您好，感谢您的咨询！我已收到您的消息："
-            var = {customer_message}
-            "。请问还有其他问题吗？"
+            reply_content = f"您好，感谢您的咨询！我已收到您的消息：{customer_message}。请问还有其他问题吗？"
 
             # 构造回复数据
             reply = {
@@ -105,13 +108,10 @@ class AIService:
                 "processed_time": int(time.time() * 1000)
             }
             
-            # 添加一些处理延迟，模拟AI处理时间
-            await asyncio.sleep(1)
-            
             logger.info(f"生成回复: {reply_content}")
             return reply
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             logger.error(f"消息解析失败: {message_data}")
             return None
         except Exception as e:
@@ -130,25 +130,49 @@ class AIService:
         
         logger.info(f"开始监听卖家 {seller_id} 的消息队列")
         
+        # 待推送的回复在内存中攒批，按数量或时间阈值一次性推送
+        pending_replies = []
+        last_flush = time.monotonic()
+        
         while self.running:
             try:
-                # 使用阻塞式弹出，等待客户消息
-                result = await self.redis.blpop(customer_queue, timeout=1)
+                if pending_replies:
+                    # 还有待推送的回复时不阻塞等待，队列为空则下方立即推送
+                    message_data = await self.redis.lpop(customer_queue)
+                    result = (customer_queue, message_data) if message_data is not None else None
+                else:
+                    # 使用阻塞式弹出，等待客户消息
+                    result = await self.redis.blpop(customer_queue, timeout=1)
+                drained = True
                 
-                if not result:
-                    # 超时或队列为空
-                    continue
+                if result:
+                    # result是一个元组(key, value)，我们需要value
+                    _, message_data = result
+                    batch = [message_data]
                     
-                # result是一个元组(key, value)，我们需要value
-                _, message_data = result
-                
-                # 处理消息，生成回复
-                reply = await self.process_message(message_data)
+                    # 一次往返取出队列中已积压的其余消息（LRANGE+LTRIM在事务中原子执行）
+                    if self.batch_size > 1:
+                        async with self.redis.pipeline(transaction=True) as pipe:
+                            pipe.lrange(customer_queue, 0, self.batch_size - 2)
+                            pipe.ltrim(customer_queue, self.batch_size - 1, -1)
+                            backlog, _ = await pipe.execute()
+                        batch.extend(backlog)
+                    drained = len(batch) < self.batch_size
+                    
+                    # 并发处理整批消息，生成回复
+                    results = await asyncio.gather(*(self.process_message(m) for m in batch))
+                    pending_replies.extend(orjson.dumps(reply) for reply in results if reply)
                 
-                if reply:
-                    # 将回复推送到回复队列
-                    await self.redis.rpush(response_queue, json.dumps(reply))
-                    logger.info(f"回复已推送到队列: {response_queue}")
+                # 队列已取空、攒够一批或距上次推送超过阈值时推送
+                if pending_replies and (
+                    drained
+                    or len(pending_replies) >= self.reply_flush_size
+                    or time.monotonic() - last_flush >= self.reply_flush_interval
+                ):
+                    await self.redis.rpush(response_queue, *pending_replies)
+                    logger.info(f"{len(pending_replies)}条回复已推送到队列: {response_queue}")
+                    pending_replies.clear()
+                    last_flush = time.monotonic()
                     
             except asyncio.CancelledError:
                 logger.info(f"监听卖家 {seller_id} 的任务被取消")
@@ -157,6 +181,14 @@ class AIService:
                 logger.error(f"监听卖家 {seller_id} 的消息队列时发生错误: {str(e)}")
                 # 等待一段时间后重试
                 await asyncio.sleep(5)
+        
+        # 退出前推送剩余的回复
+        if pending_replies:
+            try:
+                await self.redis.rpush(response_queue, *pending_replies)
+                logger.info(f"{len(pending_replies)}条回复已推送到队列: {response_queue}")
+            except Exception as e:
+                logger.error(f"推送剩余{len(pending_replies)}条回复失败: {str(e)}")
                 
     async def run(self):
         """运行AI服务"""
@@ -220,4 +252,10 @@ async def main():
         logger.info("接收到中断信号，服务即将停止")
     
 if __name__ == "__main__":
+    # 优先使用uvloop事件循环（Windows等不支持的平台回退到默认事件循环）
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main()) 
\ No newline at end of file
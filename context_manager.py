@@ -1,10 +1,149 @@
+import asyncio
 import sqlite3
 import os
-import json
-from datetime import datetime
+import orjson
+import queue
+import threading
+import time
+import weakref
+import zstandard
+from concurrent.futures import Future
+from pathlib import Path
+from cachetools import LRUCache
 from loguru import logger
 
 
+# 每个连接都需要设置的PRAGMA（journal_mode=WAL写入数据库文件头，只需在初始化时设置一次）
+_CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-65536;
+PRAGMA busy_timeout=5000;
+PRAGMA cache_spill=OFF;
+"""
+
+# 热路径SQL语句定义为模块级常量，配合长连接的语句缓存避免重复解析
+_SQL_UPSERT_ITEM = """
+INSERT INTO items (item_id, data, price, description, last_updated, title, sold_price) 
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(item_id) 
+DO UPDATE SET data = excluded.data, price = excluded.price, 
+              description = excluded.description, last_updated = excluded.last_updated,
+              title = excluded.title, sold_price = excluded.sold_price
+"""
+
+_SQL_SELECT_ITEM = "SELECT data FROM items WHERE item_id = ?"
+
+# 升级前保存的商品没有title和sold_price，此时不返回结果，由get_item_summary解析完整数据后回填
+_SQL_SELECT_ITEM_SUMMARY = (
+    "SELECT title, sold_price FROM items "
+    "WHERE item_id = ? AND title IS NOT NULL AND sold_price IS NOT NULL"
+)
+
+_SQL_BACKFILL_ITEM_SUMMARY = (
+    "UPDATE items SET title = ?, sold_price = ? "
+    "WHERE item_id = ? AND sold_price IS NULL"
+)
+
+_SQL_INSERT_MSG = "INSERT INTO messages (user_id, item_id, role, content, timestamp, chat_id) VALUES (?, ?, ?, ?, ?, ?)"
+
+# 只保留每个会话最新的max_history条消息
+_SQL_TRIM = """
+DELETE FROM messages 
+WHERE chat_id = ? AND id NOT IN (
+    SELECT id FROM messages 
+    WHERE chat_id = ? 
+    ORDER BY id DESC 
+    LIMIT ?
+)
+"""
+
+# 清理是分批进行的，消息数可能暂时超过max_history，因此取最新的max_history条
+_SQL_SELECT_CTX = """
+SELECT role, content FROM (
+    SELECT id, role, content FROM messages 
+    WHERE chat_id = ? 
+    ORDER BY id DESC
+    LIMIT ?
+)
+ORDER BY id ASC
+"""
+
+_SQL_UPSERT_BARGAIN = """
+INSERT INTO chat_bargain_counts (chat_id, count, last_updated)
+VALUES (?, 1, ?)
+ON CONFLICT(chat_id) 
+DO UPDATE SET count = count + 1, last_updated = excluded.last_updated
+RETURNING count
+"""
+
+_SQL_SELECT_BARGAIN = "SELECT count FROM chat_bargain_counts WHERE chat_id = ?"
+
+
+# 旧版本以ISO-8601文本（本地时间）存储时间，启动时将其转换为毫秒级Unix时间戳
+# 数据库结构版本，记录在PRAGMA user_version中；版本落后时才执行一次性迁移
+_SCHEMA_VERSION = 1
+
+_TIMESTAMP_COLUMNS = (
+    ("messages", "timestamp"),
+    ("chat_bargain_counts", "last_updated"),
+    ("items", "last_updated"),
+)
+
+
+def _now_ms():
+    """获取当前时间的毫秒级Unix时间戳"""
+    return time.time_ns() // 1_000_000
+
+
+def _connect(db_path, read_only=False):
+    """创建数据库连接并应用连接级PRAGMA，read_only为True时以只读模式打开"""
+    if read_only:
+        conn = sqlite3.connect(f"{Path(db_path).absolute().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.executescript(_CONNECTION_PRAGMAS)
+    return conn
+
+
+def _writer_loop(conn, write_queue):
+    """写线程：独占写连接，按提交顺序依次执行队列中的写操作，收到None时退出"""
+    try:
+        while True:
+            task = write_queue.get()
+            if task is None:
+                break
+            future, op, args = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(op(conn, *args))
+                except Exception as e:
+                    future.set_exception(e)
+            # 释放对操作的引用，避免阻塞等待期间持有管理器对象
+            task = future = op = args = None
+    finally:
+        # 关闭前让SQLite按需更新查询规划器统计信息
+        try:
+            conn.execute("PRAGMA optimize")
+        except Exception as e:
+            logger.warning(f"更新数据库统计信息时出错: {e}")
+        conn.close()
+
+
+def _close_connections(write_queue, writer, connections):
+    """停止写线程（先处理完队列中剩余的写操作），再关闭所有读连接"""
+    write_queue.put(None)
+    if writer is not threading.current_thread():
+        writer.join()
+    while connections:
+        conn = connections.pop()
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"关闭数据库连接时出错: {e}")
+
+
 class ChatContextManager:
     """
     聊天上下文管理器
@@ -13,28 +152,90 @@ class ChatContextManager:
     支持按会话ID检索对话历史，以及议价次数统计。
     """
     
-    def __init__(self, max_history=100, db_path="data/chat_history.db"):
+    def __init__(self, max_history=100, db_path="data/chat_history.db", trim_interval=10):
         """
         初始化聊天上下文管理器
         
         Args:
             max_history: 每个对话保留的最大消息数
             db_path: SQLite数据库文件路径
+            trim_interval: 每个对话每插入多少条消息清理一次旧消息
         """
         self.max_history = max_history
         self.db_path = db_path
-        self._init_db()
+        self.trim_interval = trim_interval
+        # 记录每个对话自上次清理以来插入的消息数，只在写线程中访问；
+        # 用LRU限制大小，被淘汰的对话下次插入时会重新清理一次
+        self._inserts_since_trim = LRUCache(maxsize=10_000)
+        # 议价次数与商品信息的进程内LRU缓存，命中时无需查询SQLite
+        self._bargain_cache = LRUCache(maxsize=10_000)
+        self._item_cache = LRUCache(maxsize=5_000)
+        self._cache_lock = threading.Lock()
+        # 读操作：每个线程复用一个只读长连接，WAL模式下与写线程互不阻塞
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # 写操作：由独占写连接的后台线程按队列顺序执行，避免写锁竞争
+        self._write_queue = queue.Queue()
+        self._writer = threading.Thread(
+            target=_writer_loop,
+            args=(self._init_db(), self._write_queue),
+            name="ChatContextWriter",
+            daemon=True
+        )
+        self._writer.start()
+        # 对象回收或进程退出时停止写线程并关闭所有连接
+        self._finalizer = weakref.finalize(
+            self, _close_connections, self._write_queue, self._writer, self._connections
+        )
+
+    def _conn(self):
+        """获取当前线程复用的只读数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = _connect(self.db_path, read_only=True)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _submit_write(self, op, *args):
+        """
+        将写操作提交给写线程执行
+        
+        Args:
+            op: 写操作函数，第一个参数为写连接
+            args: 传给写操作的其他参数
+            
+        Returns:
+            Future: 写操作完成后得到结果
+        """
+        future = Future()
+        self._write_queue.put((future, op, args))
+        return future
+
+    def close(self):
+        """等待写线程处理完剩余写操作，并关闭所有数据库连接"""
+        self._finalizer()
         
     def _init_db(self):
-        """初始化数据库表结构"""
+        """
+        初始化数据库表结构
+        
+        Returns:
+            sqlite3.Connection: 初始化使用的连接，之后交给写线程继续使用
+        """
         # 确保数据库目录存在
         db_dir = os.path.dirname(self.db_path)
         if db_dir and not os.path.exists(db_dir):
             os.makedirs(db_dir)
             
-        conn = sqlite3.connect(self.db_path)
+        conn = _connect(self.db_path)
         cursor = conn.cursor()
         
+        # 启用WAL模式：读写互不阻塞，提交只需顺序追加日志
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
         # 创建消息表
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -43,7 +244,7 @@ class ChatContextManager:
             item_id TEXT NOT NULL,
             role TEXT NOT NULL,
             content TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp INTEGER DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
             chat_id TEXT
         )
         ''')
@@ -73,7 +274,7 @@ class ChatContextManager:
         CREATE TABLE IF NOT EXISTS chat_bargain_counts (
             chat_id TEXT PRIMARY KEY,
             count INTEGER DEFAULT 0,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            last_updated INTEGER DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))
         )
         ''')
         
@@ -81,16 +282,56 @@ class ChatContextManager:
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS items (
             item_id TEXT PRIMARY KEY,
-            data TEXT NOT NULL,
+            data BLOB NOT NULL,
             price REAL,
             description TEXT,
-            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            last_updated INTEGER DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
+            title TEXT,
+            sold_price TEXT
         )
         ''')
         
         conn.commit()
-        conn.close()
+        
+        # 旧数据库迁移需要全表扫描，只在结构版本落后时执行一次
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] < _SCHEMA_VERSION:
+            self._migrate_db(cursor)
+            cursor.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            conn.commit()
+        
+        # 首次启动时收集查询规划器统计信息（保存在sqlite_stat1中，之后由关闭时的PRAGMA optimize更新）
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        if cursor.fetchone() is None:
+            cursor.execute("ANALYZE")
+            conn.commit()
+            logger.info("已收集数据库统计信息")
+        
+        cursor.close()
         logger.info(f"聊天历史数据库初始化完成: {self.db_path}")
+        return conn
+
+    def _migrate_db(self, cursor):
+        """将旧数据库升级到当前结构版本"""
+        # 检查是否需要添加title字段（兼容旧数据库）
+        cursor.execute("PRAGMA table_info(items)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'title' not in columns:
+            cursor.execute('ALTER TABLE items ADD COLUMN title TEXT')
+            logger.info("已为items表添加title字段")
+        # 检查是否需要添加sold_price字段，保存接口返回的原始价格文本
+        if 'sold_price' not in columns:
+            cursor.execute('ALTER TABLE items ADD COLUMN sold_price TEXT')
+            logger.info("已为items表添加sold_price字段")
+        
+        # 将旧数据中的文本时间转换为毫秒级Unix时间戳
+        for table, column in _TIMESTAMP_COLUMNS:
+            cursor.execute(
+                f"UPDATE {table} SET {column} = CAST(ROUND((julianday({column}, 'utc') - 2440587.5) * 86400000) AS INTEGER) "
+                f"WHERE typeof({column}) = 'text'"
+            )
+            if cursor.rowcount > 0:
+                logger.info(f"已将{table}表的{cursor.rowcount}条{column}转换为毫秒时间戳")
         
 
             
@@ -102,37 +343,37 @@ class ChatContextManager:
             item_id: 商品ID
             item_data: 商品信息字典
         """
-        conn = sqlite3.connect(self.db_path)
+        self._submit_write(self._save_item_info, item_id, item_data).result()
+
+    def _save_item_info(self, conn, item_id, item_data):
+        """在写线程中保存商品信息"""
         cursor = conn.cursor()
         
         try:
             # 从商品数据中提取有用信息
             price = float(item_data.get('soldPrice', 0))
             description = item_data.get('desc', '')
+            title = item_data.get('title', '')
+            sold_price = str(item_data.get('soldPrice', ''))
             
-            # 将整个商品数据转换为JSON字符串
-            data_json = json.dumps(item_data, ensure_ascii=False)
+            # 将整个商品数据序列化为JSON并用zstd压缩（压缩器非线程安全，每次单独创建）
+            data_blob = zstandard.ZstdCompressor().compress(orjson.dumps(item_data))
             
             cursor.execute(
-                """
-                INSERT INTO items (item_id, data, price, description, last_updated) 
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(item_id) 
-                DO UPDATE SET data = ?, price = ?, description = ?, last_updated = ?
-                """,
-                (
-                    item_id, data_json, price, description, datetime.now().isoformat(),
-                    data_json, price, description, datetime.now().isoformat()
-                )
+                _SQL_UPSERT_ITEM,
+                (item_id, data_blob, price, description, _now_ms(), title, sold_price)
             )
             
             conn.commit()
-            logger.debug(f"商品信息已保存: {item_id}")
+            # 以写线程提交的数据为准更新缓存，避免读线程的旧数据覆盖
+            with self._cache_lock:
+                self._item_cache[item_id] = item_data
+            logger.debug("商品信息已保存: {}", item_id)
         except Exception as e:
             logger.error(f"保存商品信息时出错: {e}")
             conn.rollback()
         finally:
-            conn.close()
+            cursor.close()
     
     def get_item_info(self, item_id):
         """
@@ -144,24 +385,102 @@ class ChatContextManager:
         Returns:
             dict: 商品信息字典，如果不存在返回None
         """
-        conn = sqlite3.connect(self.db_path)
+        with self._cache_lock:
+            item_info = self._item_cache.get(item_id)
+        if item_info is not None:
+            return item_info
+        
+        conn = self._conn()
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                "SELECT data FROM items WHERE item_id = ?",
-                (item_id,)
-            )
+            cursor.execute(_SQL_SELECT_ITEM, (item_id,))
             
             result = cursor.fetchone()
             if result:
-                return json.loads(result[0])
+                data = result[0]
+                # 旧数据库中的商品数据是未压缩的JSON字符串
+                if isinstance(data, bytes):
+                    data = zstandard.ZstdDecompressor().decompress(data)
+                item_info = orjson.loads(data)
+                # 写线程可能已在读取期间写入了更新的数据，此时以缓存为准
+                with self._cache_lock:
+                    return self._item_cache.setdefault(item_id, item_info)
             return None
         except Exception as e:
             logger.error(f"获取商品信息时出错: {e}")
             return None
         finally:
-            conn.close()
+            cursor.close()
+
+    def get_item_summary(self, item_id):
+        """
+        获取商品标题和价格，只读取对应列而不解析完整商品数据
+        
+        Args:
+            item_id: 商品ID
+            
+        Returns:
+            tuple: (标题, 价格文本)，价格保持接口返回的原始格式，如果不存在返回None
+        """
+        with self._cache_lock:
+            item_info = self._item_cache.get(item_id)
+        if item_info is not None:
+            return item_info.get('title', ''), str(item_info.get('soldPrice', ''))
+        
+        conn = self._conn()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(_SQL_SELECT_ITEM_SUMMARY, (item_id,))
+            summary = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"获取商品摘要时出错: {e}")
+            return None
+        finally:
+            cursor.close()
+        if summary:
+            return summary
+        
+        # 旧数据缺少摘要字段时从完整商品数据中读取，并交给写线程回填，无需等待写入完成
+        item_info = self.get_item_info(item_id)
+        if item_info is None:
+            return None
+        title, sold_price = item_info.get('title', ''), str(item_info.get('soldPrice', ''))
+        self._submit_write(self._backfill_item_summary, item_id, title, sold_price)
+        return title, sold_price
+
+    def _backfill_item_summary(self, conn, item_id, title, sold_price):
+        """在写线程中为旧数据回填标题和原始价格文本"""
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(_SQL_BACKFILL_ITEM_SUMMARY, (title, sold_price, item_id))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"回填商品摘要时出错: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+    async def asave_item_info(self, item_id, item_data):
+        """交给写线程保存商品信息，不阻塞事件循环"""
+        await asyncio.wrap_future(self._submit_write(self._save_item_info, item_id, item_data))
+
+    async def aget_item_info(self, item_id):
+        """在线程池中获取商品信息，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.get_item_info, item_id)
+
+    async def ensure_item_cached(self, item_id):
+        """确保商品信息已从数据库加载到缓存中，缓存命中时直接返回"""
+        with self._cache_lock:
+            if item_id in self._item_cache:
+                return
+        await self.aget_item_info(item_id)
+
+    async def aget_item_summary(self, item_id):
+        """在线程池中获取商品标题和价格，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.get_item_summary, item_id)
 
     def add_message_by_chat(self, chat_id, user_id, item_id, role, content):
         """
@@ -174,40 +493,91 @@ class ChatContextManager:
             role: 消息角色 (user/assistant)
             content: 消息内容
         """
-        conn = sqlite3.connect(self.db_path)
+        self._submit_write(self._add_message_by_chat, chat_id, user_id, item_id, role, content).result()
+
+    def _add_message_by_chat(self, conn, chat_id, user_id, item_id, role, content):
+        """在写线程中添加消息"""
         cursor = conn.cursor()
         
         try:
+            # 插入与清理在同一个事务中完成，只提交一次
+            cursor.execute("BEGIN IMMEDIATE")
+            
             # 插入新消息，使用chat_id作为额外标识
             cursor.execute(
-                "INSERT INTO messages (user_id, item_id, role, content, timestamp, chat_id) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, item_id, role, content, datetime.now().isoformat(), chat_id)
+                _SQL_INSERT_MSG,
+                (user_id, item_id, role, content, _now_ms(), chat_id)
             )
             
-            # 检查是否需要清理旧消息（基于chat_id）
-            cursor.execute(
-                """
-                SELECT id FROM messages 
-                WHERE chat_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?, 1
-                """, 
-                (chat_id, self.max_history)
+            self._maybe_trim_chat(cursor, chat_id, 1)
+            
+            conn.commit()
+        except Exception as e:
+            logger.error(f"添加消息到数据库时出错: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+    def add_messages_by_chat(self, rows):
+        """
+        在一个事务中批量添加消息到对话历史
+        
+        Args:
+            rows: 由(chat_id, user_id, item_id, role, content)组成的消息列表，按时间先后排列
+        """
+        if rows:
+            self._submit_write(self._add_messages_by_chat, rows).result()
+
+    async def aadd_messages_by_chat(self, rows):
+        """交给写线程批量添加消息，不阻塞事件循环"""
+        if rows:
+            await asyncio.wrap_future(self._submit_write(self._add_messages_by_chat, rows))
+
+    def _add_messages_by_chat(self, conn, rows):
+        """在写线程中批量添加消息"""
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            now = _now_ms()
+            cursor.executemany(
+                _SQL_INSERT_MSG,
+                [
+                    (user_id, item_id, role, content, now, chat_id)
+                    for chat_id, user_id, item_id, role, content in rows
+                ]
             )
             
-            oldest_to_keep = cursor.fetchone()
-            if oldest_to_keep:
-                cursor.execute(
-                    "DELETE FROM messages WHERE chat_id = ? AND id < ?",
-                    (chat_id, oldest_to_keep[0])
-                )
+            # 统计每个会话本批插入的消息数，再按会话清理旧消息
+            counts = {}
+            for row in rows:
+                counts[row[0]] = counts.get(row[0], 0) + 1
+            for chat_id, inserted in counts.items():
+                self._maybe_trim_chat(cursor, chat_id, inserted)
             
             conn.commit()
         except Exception as e:
-            logger.error(f"添加消息到数据库时出错: {e}")
+            logger.error(f"批量添加消息到数据库时出错: {e}")
             conn.rollback()
         finally:
-            conn.close()
+            cursor.close()
+
+    def _maybe_trim_chat(self, cursor, chat_id, inserted):
+        """
+        每隔trim_interval条消息清理一次旧消息（基于chat_id），启动后的首次插入总会触发清理
+        
+        Args:
+            cursor: 当前事务中的游标
+            chat_id: 会话ID
+            inserted: 本次插入的消息数
+        """
+        pending = self._inserts_since_trim.get(chat_id)
+        if pending is None or pending + inserted >= self.trim_interval:
+            cursor.execute(_SQL_TRIM, (chat_id, chat_id, self.max_history))
+            self._inserts_since_trim[chat_id] = 0
+        else:
+            self._inserts_since_trim[chat_id] = pending + inserted
 
     def get_context_by_chat(self, chat_id):
         """
@@ -219,24 +589,16 @@ class ChatContextManager:
         Returns:
             list: 包含对话历史的列表
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn()
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                """
-                SELECT role, content FROM messages 
-                WHERE chat_id = ? 
-                ORDER BY timestamp ASC
-                LIMIT ?
-                """, 
-                (chat_id, self.max_history)
-            )
+            cursor.execute(_SQL_SELECT_CTX, (chat_id, self.max_history))
             
             messages = [{"role": role, "content": content} for role, content in cursor.fetchall()]
             
-            # 获取议价次数并添加到上下文中
-            bargain_count = self.get_bargain_count_by_chat(chat_id)
+            # 在同一个游标上获取议价次数并添加到上下文中
+            bargain_count = self._get_bargain_count(cursor, chat_id)
             if bargain_count > 0:
                 messages.append({
                     "role": "system", 
@@ -247,39 +609,50 @@ class ChatContextManager:
             logger.error(f"获取对话历史时出错: {e}")
             messages = []
         finally:
-            conn.close()
+            cursor.close()
         
         return messages
 
+    async def aget_context_by_chat(self, chat_id):
+        """在线程池中获取对话历史，避免阻塞事件循环"""
+        return await asyncio.to_thread(self.get_context_by_chat, chat_id)
+
     def increment_bargain_count_by_chat(self, chat_id):
         """
         基于会话ID增加议价次数
         
         Args:
             chat_id: 会话ID
+            
+        Returns:
+            int: 增加后的议价次数，出错时返回None
         """
-        conn = sqlite3.connect(self.db_path)
+        return self._submit_write(self._increment_bargain_count_by_chat, chat_id).result()
+
+    async def aincrement_bargain_count_by_chat(self, chat_id):
+        """交给写线程增加议价次数，不阻塞事件循环"""
+        return await asyncio.wrap_future(self._submit_write(self._increment_bargain_count_by_chat, chat_id))
+
+    def _increment_bargain_count_by_chat(self, conn, chat_id):
+        """在写线程中增加议价次数"""
         cursor = conn.cursor()
         
         try:
             # 使用UPSERT语法直接基于chat_id增加议价次数
-            cursor.execute(
-                """
-                INSERT INTO chat_bargain_counts (chat_id, count, last_updated)
-                VALUES (?, 1, ?)
-                ON CONFLICT(chat_id) 
-                DO UPDATE SET count = count + 1, last_updated = ?
-                """,
-                (chat_id, datetime.now().isoformat(), datetime.now().isoformat())
-            )
+            cursor.execute(_SQL_UPSERT_BARGAIN, (chat_id, _now_ms()))
+            count = cursor.fetchone()[0]
             
             conn.commit()
-            logger.debug(f"会话 {chat_id} 议价次数已增加")
+            # 以提交后的计数为准更新缓存，避免读线程的旧计数覆盖
+            with self._cache_lock:
+                self._bargain_cache[chat_id] = count
+            logger.debug("会话 {} 议价次数已增加", chat_id)
+            return count
         except Exception as e:
             logger.error(f"增加议价次数时出错: {e}")
             conn.rollback()
         finally:
-            conn.close()
+            cursor.close()
 
     def get_bargain_count_by_chat(self, chat_id):
         """
@@ -291,19 +664,37 @@ class ChatContextManager:
         Returns:
             int: 议价次数
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn()
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                "SELECT count FROM chat_bargain_counts WHERE chat_id = ?",
-                (chat_id,)
-            )
-            
-            result = cursor.fetchone()
-            return result[0] if result else 0
+            return self._get_bargain_count(cursor, chat_id)
         except Exception as e:
             logger.error(f"获取议价次数时出错: {e}")
             return 0
         finally:
-            conn.close() 
\ No newline at end of file
+            cursor.close() 
+
+    def _get_bargain_count(self, cursor, chat_id):
+        """
+        优先从缓存读取议价次数，未命中时使用给定游标查询并写入缓存
+        
+        Args:
+            cursor: 数据库游标
+            chat_id: 会话ID
+            
+        Returns:
+            int: 议价次数
+        """
+        with self._cache_lock:
+            count = self._bargain_cache.get(chat_id)
+        if count is not None:
+            return count
+        
+        cursor.execute(_SQL_SELECT_BARGAIN, (chat_id,))
+        
+        result = cursor.fetchone()
+        count = result[0] if result else 0
+        # 写线程可能已在读取期间提交了新计数，此时以缓存为准
+        with self._cache_lock:
+            return self._bargain_cache.setdefault(chat_id, count)
@@ -1,10 +1,11 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import Dict, List, Optional, Any
 import asyncio
 import time
-import uuid
 from datetime import datetime
+from operator import itemgetter
 import uvicorn
 import os
 from loguru import logger
@@ -23,11 +24,19 @@ logger.add(
     format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
 )
 
-app = FastAPI(title="闲鱼API服务", description="提供闲鱼会话管理和商品信息查询接口")
+app = FastAPI(
+    title="闲鱼API服务",
+    description="提供闲鱼会话管理和商品信息查询接口",
+    default_response_class=ORJSONResponse
+)
 
 # 会话存储
 active_sessions: Dict[str, Dict[str, Any]] = {}
 
+# /sessions 接口的静态会话视图缓存（已按状态排序），会话状态变化时失效
+_sessions_view: List[Dict[str, Any]] = []
+_sessions_view_dirty = True
+
 # 请求模型
 class SessionRequest(BaseModel):
     cookies_str: str
@@ -79,6 +88,35 @@ async def shutdown_event():
         logger.info("Redis 连接池已关闭")
 
 # 会话管理函数
+def _set_session_status(session: Dict[str, Any], status: str):
+    """更新会话状态，同时记录排序用的状态序号（活跃会话排在前面），并使会话视图缓存失效"""
+    global _sessions_view_dirty
+    session["status"] = status
+    session["status_order"] = 0 if status == "active" else 1
+    _sessions_view_dirty = True
+
+def _build_sessions_view() -> List[Dict[str, Any]]:
+    """生成不含运行时间的会话信息列表，活跃的会话排在前面"""
+    sessions_view = []
+    for session in sorted(active_sessions.values(), key=itemgetter("status_order")):
+        info = {
+            "session_id": session["session_id"],
+            "status": session["status"],
+            "start_time": session["start_time"],
+            "running_time": None
+        }
+        
+        # 如果会话已停止，添加停止时间
+        if "stop_time" in session:
+            info["stop_time"] = session["stop_time"]
+        
+        # 如果有错误信息，添加到返回数据中
+        if "error" in session:
+            info["error"] = session["error"]
+            
+        sessions_view.append(info)
+    return sessions_view
+
 async def run_xianyu_session(session_id: str, cookies_str: str, redis_client, xianyu_instance=None):
     """在后台运行闲鱼会话"""
     try:
@@ -89,26 +127,25 @@ async def run_xianyu_session(session_id: str, cookies_str: str, redis_client, xi
             xianyu = xianyu_instance
             
         active_sessions[session_id]["xianyu"] = xianyu
-        active_sessions[session_id]["task"] = asyncio.create_task(xianyu.main())
         
-        # 等待任务完成或被取消
+        # 运行会话直到完成或被取消
         try:
-            await active_sessions[session_id]["task"]
+            await xianyu.main()
         except asyncio.CancelledError:
             logger.info(f"会话 {session_id} 已取消")
         finally:
             # 如果会话已结束，从活跃会话中移除
             if session_id in active_sessions:
-                active_sessions[session_id]["status"] = "stopped"
+                _set_session_status(active_sessions[session_id], "stopped")
                 logger.info(f"会话 {session_id} 已停止")
     except Exception as e:
         logger.error(f"会话 {session_id} 发生错误: {str(e)}")
         if session_id in active_sessions:
-            active_sessions[session_id]["status"] = "error"
+            _set_session_status(active_sessions[session_id], "error")
             active_sessions[session_id]["error"] = str(e)
 
 @app.post("/start_session", response_model=SessionResponse)
-async def start_session(request: SessionRequest, background_tasks: BackgroundTasks):
+async def start_session(request: SessionRequest):
     """启动新的闲鱼会话"""
     try:
         # 检查 Redis 连接是否可用
@@ -157,19 +194,21 @@ async def start_session(request: SessionRequest, background_tasks: BackgroundTas
             else:
                 logger.info(f"清除用户 {session_id} 的旧会话信息")
         
-        # 记录会话信息
+        # 记录会话信息，时间保存为datetime对象，查询运行时间时无需再解析字符串
         active_sessions[session_id] = {
             "session_id": session_id,
-            "status": "starting",
-            "start_time": datetime.now().isoformat(),
+            "start_time": datetime.now(),
             "cookies_str": request.cookies_str
         }
+        _set_session_status(active_sessions[session_id], "starting")
         
-        # 在后台启动会话，传递已创建的闲鱼实例
-        background_tasks.add_task(run_xianyu_session, session_id, request.cookies_str, app.state.redis, xianyu)
+        # 直接创建后台任务启动会话，传递已创建的闲鱼实例；任务保存在会话中供停止时取消
+        active_sessions[session_id]["task"] = asyncio.create_task(
+            run_xianyu_session(session_id, request.cookies_str, app.state.redis, xianyu)
+        )
         
         # 更新状态为活跃
-        active_sessions[session_id]["status"] = "active"
+        _set_session_status(active_sessions[session_id], "active")
         
         # 向Redis Pub/Sub通道发送会话启动通知
         try:
@@ -219,8 +258,8 @@ async def stop_session(request: StopSessionRequest):
             logger.warning(f"会话 {session_id} 无活动任务或任务已完成")
         
         # 更新会话状态
-        active_sessions[session_id]["status"] = "stopped"
-        active_sessions[session_id]["stop_time"] = datetime.now().isoformat()
+        _set_session_status(active_sessions[session_id], "stopped")
+        active_sessions[session_id]["stop_time"] = datetime.now()
         
         # 向Redis Pub/Sub通道发送会话停止通知
         try:
@@ -253,39 +292,27 @@ async def stop_session(request: StopSessionRequest):
 @app.get("/sessions", response_model=SessionsResponse)
 async def get_sessions():
     """获取所有活跃会话列表"""
+    global _sessions_view, _sessions_view_dirty
     try:
+        # 会话状态未变化时直接复用缓存的会话视图
+        if _sessions_view_dirty:
+            _sessions_view = _build_sessions_view()
+            _sessions_view_dirty = False
+        
         sessions_info = []
-        for session_id, session in active_sessions.items():
+        current_time = datetime.now()
+        for cached_info in _sessions_view:
             # 计算会话运行时间
-            start_time = datetime.fromisoformat(session["start_time"])
-            current_time = datetime.now()
-            running_time_seconds = (current_time - start_time).total_seconds()
+            running_time_seconds = int((current_time - cached_info["start_time"]).total_seconds())
             
             # 格式化运行时间
-            hours, remainder = divmod(int(running_time_seconds), 3600)
+            hours, remainder = divmod(running_time_seconds, 3600)
             minutes, seconds = divmod(remainder, 60)
-            running_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-            
-            info = {
-                "session_id": session_id,
-                "status": session["status"],
-                "start_time": session["start_time"],
-                "running_time": running_time
-            }
-            
-            # 如果会话已停止，添加停止时间
-            if "stop_time" in session:
-                info["stop_time"] = session["stop_time"]
             
-            # 如果有错误信息，添加到返回数据中
-            if "error" in session:
-                info["error"] = session["error"]
-                
+            info = cached_info.copy()
+            info["running_time"] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
             sessions_info.append(info)
         
-        # 按状态排序：活跃的会话排在前面
-        sessions_info.sort(key=lambda x: 0 if x["status"] == "active" else 1)
-        
         return {
             "status": "success",
             "active_sessions": sessions_info
@@ -322,28 +349,31 @@ async def get_item_detail(session_id: str, item_id: str):
                 "message": "获取商品详情失败: 会话未初始化完成"
             }
         
-        # 从缓存中获取商品信息
-        item_info = xianyu.context_manager.get_item_info(item_id)
-        
-        # 如果缓存中没有，则从API获取
-        if not item_info:
-            api_result = xianyu.xianyu.get_item_info(item_id)
+        # 从缓存中获取商品标题和价格，无需解析完整商品数据
+        summary = await xianyu.context_manager.aget_item_summary(item_id)
+        if summary:
+            item_name, price = summary
+        else:
+            # 数据库中没有该商品，则从API获取
+            api_result = await xianyu.xianyu.get_item_info(item_id)
             if 'data' in api_result and 'itemDO' in api_result['data']:
                 item_info = api_result['data']['itemDO']
                 # 保存到缓存
-                xianyu.context_manager.save_item_info(item_id, item_info)
+                await xianyu.context_manager.asave_item_info(item_id, item_info)
             else:
                 return {
                     "status": "error",
                     "message": "获取商品详情失败: API返回错误"
                 }
+            item_name = item_info.get("title", "")
+            price = item_info.get("soldPrice", "")
         
         # 返回商品信息
         return {
             "status": "success",
             "item_id": item_id,
-            "item_name": item_info.get("title", ""),
-            "price": str(item_info.get("soldPrice", ""))
+            "item_name": item_name,
+            "price": str(price)
         }
     except Exception as e:
         logger.error(f"获取商品详情失败: {str(e)}")
@@ -358,7 +388,7 @@ async def health_check():
     redis_status = "connected" if hasattr(app.state, "redis") else "disconnected"
     return {
         "status": "healthy", 
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": datetime.now(),
         "redis": redis_status
     }
 
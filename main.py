@@ -10,7 +10,7 @@ from XianyuApis import XianyuApis
 import sys
 
 
-from utils.xianyu_utils import generate_mid, generate_uuid, trans_cookies, generate_device_id, decrypt
+from utils.xianyu_utils import generate_mid, generate_uuid, trans_cookies, generate_device_id, decrypt_bytes
 from XianyuAgent import XianyuReplyBot
 from context_manager import ChatContextManager
 
@@ -52,6 +52,13 @@ class XianyuLive:
         
         # 人工接管关键词，从环境变量读取
         self.toggle_keywords = os.getenv("TOGGLE_KEYWORDS", "。")
+        
+        # 消息写入缓冲，突发消息攒批后一次性写入数据库
+        self.message_batch_size = 50
+        self.message_batch_delay = 0.05
+        self.pending_messages = []
+        self.message_flush_task = None
+        self.message_flush_lock = asyncio.Lock()
 
     async def refresh_token(self):
         """刷新token"""
@@ -59,7 +66,7 @@ class XianyuLive:
             logger.info("开始刷新token...")
             
             # 获取新token（如果Cookie失效，get_token会直接退出程序）
-            token_result = self.xianyu.get_token(self.device_id)
+            token_result = await self.xianyu.get_token(self.device_id)
             if 'data' in token_result and 'accessToken' in token_result['data']:
                 new_token = token_result['data']['accessToken']
                 self.current_token = new_token
@@ -325,7 +332,7 @@ class XianyuLive:
                     return
                 except Exception as e:
                     # logger.info(f'加密数据: {data}')
-                    decrypted_data = decrypt(data)
+                    decrypted_data = decrypt_bytes(data)
                     message = json.loads(decrypted_data)
             except Exception as e:
                 logger.error(f"消息解密失败: {e}")
@@ -358,7 +365,7 @@ class XianyuLive:
                 return
             elif not self.is_chat_message(message):
                 logger.debug("其他非聊天消息")
-                logger.debug(f"原始消息: {message}")
+                logger.debug("原始消息: {}", message)
                 return
 
             # 处理聊天消息
@@ -395,13 +402,13 @@ class XianyuLive:
                     return
                 
                 # 记录卖家人工回复
-                self.context_manager.add_message_by_chat(chat_id, self.myid, item_id, "assistant", send_message)
+                await self.queue_message(chat_id, self.myid, item_id, "assistant", send_message)
                 logger.info(f"卖家人工回复 (会话: {chat_id}, 商品: {item_id}): {send_message}")
                 return
             
             logger.info(f"用户: {send_user_name} (ID: {send_user_id}), 商品: {item_id}, 会话: {chat_id}, 消息: {send_message}")
             # 添加用户消息到上下文
-            self.context_manager.add_message_by_chat(chat_id, send_user_id, item_id, "user", send_message)
+            await self.queue_message(chat_id, send_user_id, item_id, "user", send_message)
             
             # 如果当前会话处于人工接管模式，不进行自动回复
             if self.is_manual_mode(chat_id):
@@ -411,14 +418,14 @@ class XianyuLive:
                 logger.debug("系统消息，跳过处理")
                 return
             # 从数据库中获取商品信息，如果不存在则从API获取并保存
-            item_info = self.context_manager.get_item_info(item_id)
+            item_info = await self.context_manager.aget_item_info(item_id)
             if not item_info:
                 logger.info(f"从API获取商品信息: {item_id}")
-                api_result = self.xianyu.get_item_info(item_id)
+                api_result = await self.xianyu.get_item_info(item_id)
                 if 'data' in api_result and 'itemDO' in api_result['data']:
                     item_info = api_result['data']['itemDO']
                     # 保存商品信息到数据库
-                    self.context_manager.save_item_info(item_id, item_info)
+                    await self.context_manager.asave_item_info(item_id, item_info)
                 else:
                     logger.warning(f"获取商品信息失败: {api_result}")
                     return
@@ -427,8 +434,9 @@ class XianyuLive:
                 
             item_description = f"{item_info['desc']};当前商品售卖价格为:{str(item_info['soldPrice'])}"
             
-            # 获取完整的对话上下文
-            context = self.context_manager.get_context_by_chat(chat_id)
+            # 获取完整的对话上下文，先写入缓冲中的消息保证上下文完整
+            await self.flush_messages()
+            context = await self.context_manager.aget_context_by_chat(chat_id)
             # 生成回复
             bot_reply = bot.generate_reply(
                 send_message,
@@ -438,19 +446,49 @@ class XianyuLive:
             
             # 检查是否为价格意图，如果是则增加议价次数
             if bot.last_intent == "price":
-                self.context_manager.increment_bargain_count_by_chat(chat_id)
-                bargain_count = self.context_manager.get_bargain_count_by_chat(chat_id)
+                bargain_count = await self.context_manager.aincrement_bargain_count_by_chat(chat_id)
                 logger.info(f"用户 {send_user_name} 对商品 {item_id} 的议价次数: {bargain_count}")
             
             # 添加机器人回复到上下文
-            self.context_manager.add_message_by_chat(chat_id, self.myid, item_id, "assistant", bot_reply)
+            await self.queue_message(chat_id, self.myid, item_id, "assistant", bot_reply)
             
             logger.info(f"机器人回复: {bot_reply}")
             await self.send_msg(websocket, chat_id, send_user_id, bot_reply)
             
         except Exception as e:
             logger.error(f"处理消息时发生错误: {str(e)}")
-            logger.debug(f"原始消息: {message_data}")
+            logger.debug("原始消息: {}", message_data)
+
+    async def queue_message(self, chat_id, user_id, item_id, role, content):
+        """
+        将消息加入写入缓冲，攒够一批或等待片刻后统一写入数据库
+        
+        Args:
+            chat_id: 会话ID
+            user_id: 用户ID
+            item_id: 商品ID
+            role: 消息角色 (user/assistant)
+            content: 消息内容
+        """
+        self.pending_messages.append((chat_id, user_id, item_id, role, content))
+        if len(self.pending_messages) >= self.message_batch_size:
+            await self.flush_messages()
+        elif self.message_flush_task is None or self.message_flush_task.done():
+            self.message_flush_task = asyncio.create_task(self._delayed_flush_messages())
+
+    async def _delayed_flush_messages(self):
+        """等待攒批延迟后写入缓冲中的消息"""
+        await asyncio.sleep(self.message_batch_delay)
+        await self.flush_messages()
+
+    async def flush_messages(self):
+        """将缓冲中的消息批量写入数据库"""
+        # 加锁保证各批次按顺序落库
+        async with self.message_flush_lock:
+            if not self.pending_messages:
+                return
+            rows, self.pending_messages = self.pending_messages, []
+            await self.context_manager.aadd_messages_by_chat(rows)
 
     async def send_heartbeat(self, ws):
         """发送心跳包并等待响应"""
@@ -574,7 +612,7 @@ class XianyuLive:
                             logger.error("消息解析失败")
                         except Exception as e:
                             logger.error(f"处理消息时发生错误: {str(e)}")
-                            logger.debug(f"原始消息: {message}")
+                            logger.debug("原始消息: {}", message)
 
             except websockets.exceptions.ConnectionClosed:
                 logger.warning("WebSocket连接已关闭")
@@ -598,6 +636,9 @@ class XianyuLive:
                     except asyncio.CancelledError:
                         pass
                 
+                # 写入缓冲中尚未落库的消息
+                await self.flush_messages()
+                
                 # 如果是主动重启，立即重连；否则等待5秒
                 if self.connection_restart_flag:
                     logger.info("主动重启连接，立即重连...")